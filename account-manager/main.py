@@ -1,24 +1,296 @@
 import asyncio
+import functools
+import glob
 import json
 import random
 import os
+import secrets
+import shutil
+import string
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Optional
-from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from dataclasses import asdict, dataclass
+from pathlib import Path
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from fake_useragent import UserAgent
+from selenium.common.exceptions import TimeoutException
 import undetected_chromedriver as uc
-from pymongo import MongoClient
-import redis
+import numpy as np
+import orjson
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+import redis.asyncio as aioredis
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-@dataclass
+# Browser pool sizing: live browsers (checked out plus idle) are capped at
+# BROWSER_POOL_SIZE and each instance is recycled after BROWSER_MAX_USES checkouts
+BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', '4'))
+BROWSER_MAX_USES = int(os.getenv('BROWSER_MAX_USES', '20'))
+# Origins whose storage is always wiped before a pooled browser is reused, on top of
+# the ones the session is found to have touched (open frames and cookie domains).
+# A reused browser keeps the user-data-dir it was launched with, so history, autofill
+# and other profile state that CDP cannot clear carry over to the next account; set
+# BROWSER_MAX_USES=1 where accounts must not share a browser at all
+BROWSER_POOL_CLEAR_ORIGINS = ('https://www.tiktok.com',)
+
+# Profile writes are coalesced and flushed every BULK_WRITE_INTERVAL seconds or
+# once BULK_WRITE_MAX_OPS operations are pending
+BULK_WRITE_INTERVAL = 0.2
+BULK_WRITE_MAX_OPS = 500
+
+# Account profiles are cached in Redis for this many seconds
+PROFILE_CACHE_TTL = 3600
+# Profile fields that hold datetimes; the cached JSON copy stores them as ISO strings
+_PROFILE_DATETIME_FIELDS = ('created_at', 'last_active')
+
+# Proxy pool; in a real system this would be fed by the proxy-manager service
+PROXY_POOL = (
+    {'type': 'http', 'ip': '1.2.3.4', 'port': '8080', 'user': 'user1', 'password': 'password1'},
+    {'type': 'socks5', 'ip': '5.6.7.8', 'port': '1080', 'user': 'user2', 'password': 'password2'}
+)
+MAX_ACCOUNTS_PER_PROXY = int(os.getenv('MAX_ACCOUNTS_PER_PROXY', '3'))
+# Sorted set of JSON-encoded proxies scored by the number of accounts assigned to them.
+# An account keeps its proxy for life, so the counts are durable (no TTL) and only go
+# down when an account is discarded or removed
+PROXY_USAGE_KEY = 'proxy:usage'
+_PROXY_MEMBERS = tuple(json.dumps(proxy, sort_keys=True) for proxy in PROXY_POOL)
+# Drops proxies that are no longer in PROXY_POOL and adds new ones with a zero count
+_SEED_PROXY_POOL_LUA = """
+local current = {}
+for i = 1, #ARGV do current[ARGV[i]] = true end
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    if not current[member] then redis.call('ZREM', KEYS[1], member) end
+end
+for i = 1, #ARGV do redis.call('ZADD', KEYS[1], 'NX', 0, ARGV[i]) end
+return 1
+"""
+# Picks the least-used proxy below the per-proxy limit and counts the new
+# account against it, atomically and in a single round trip
+_RESERVE_PROXY_LUA = """
+local picked = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if picked[1] and tonumber(picked[2]) < tonumber(ARGV[1]) then
+    redis.call('ZINCRBY', KEYS[1], 1, picked[1])
+    return picked[1]
+end
+return false
+"""
+# Gives an account's slot back; proxies removed from the pool are not re-added
+_RELEASE_PROXY_LUA = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if score and tonumber(score) > 0 then
+    redis.call('ZINCRBY', KEYS[1], -1, ARGV[1])
+end
+return 1
+"""
+
+# Supported language configurations
+SUPPORTED_LANGUAGES = {
+    'en': {'name': 'English', 'locale': 'en-US'},
+    'zh': {'name': 'Chinese', 'locale': 'zh-CN'},
+    'ja': {'name': 'Japanese', 'locale': 'ja-JP'},
+    'ko': {'name': 'Korean', 'locale': 'ko-KR'},
+    'es': {'name': 'Spanish', 'locale': 'es-ES'},
+    'fr': {'name': 'French', 'locale': 'fr-FR'},
+    'de': {'name': 'German', 'locale': 'de-DE'},
+    'it': {'name': 'Italian', 'locale': 'it-IT'},
+    'pt': {'name': 'Portuguese', 'locale': 'pt-BR'},
+    'ru': {'name': 'Russian', 'locale': 'ru-RU'},
+    'ar': {'name': 'Arabic', 'locale': 'ar-SA'},
+    'hi': {'name': 'Hindi', 'locale': 'hi-IN'},
+    'th': {'name': 'Thai', 'locale': 'th-TH'}
+}
+
+# Browser fingerprint components
+# User agents are loaded once from the bundled list; no runtime parsing or fetching
+USER_AGENTS = tuple(
+    line.strip() for line in (Path(__file__).parent / 'ua_list.txt').read_text().splitlines() if line.strip()
+)
+SCREEN_RESOLUTIONS = ('1920x1080', '1366x768', '1440x900', '1536x864')
+VIEWPORT_SIZES = ('1200x800', '1366x768', '1440x900')
+COLOR_DEPTHS = (24, 32)
+PIXEL_RATIOS = (1, 1.25, 1.5, 2)
+PLATFORMS = ('Win32', 'MacIntel', 'Linux x86_64')
+WEBGL_VENDORS = ('NVIDIA Corporation', 'AMD', 'Intel Inc.')
+
+@functools.lru_cache(maxsize=None)
+def _locale_for(language: str) -> str:
+    """Map a supported language code to its browser locale"""
+    return SUPPORTED_LANGUAGES[language]['locale']
+
+# Chrome profile directories live on tmpfs and are cloned from a pre-seeded skeleton
+CHROME_PROFILE_ROOT = os.getenv('CHROME_PROFILE_ROOT', '/dev/shm/chrome_profiles')
+_GOLDEN_PROFILE_DIR = os.path.join(CHROME_PROFILE_ROOT, '_golden')
+_GOLDEN_PROFILE_FILES = {
+    'First Run': '',
+    'Local State': json.dumps({'browser': {'enabled_labs_experiments': []}}),
+    os.path.join('Default', 'Preferences'): json.dumps({
+        'browser': {'check_default_browser': False, 'has_seen_welcome_page': True},
+        'credentials_enable_service': False,
+        'profile': {'exit_type': 'Normal', 'exited_cleanly': True, 'password_manager_enabled': False},
+    }),
+}
+_golden_profile_lock = threading.Lock()
+
+def _ensure_golden_profile():
+    """Build the skeleton profile directory once per host"""
+    with _golden_profile_lock:
+        if os.path.isdir(_GOLDEN_PROFILE_DIR):
+            return
+        staging_dir = f"{_GOLDEN_PROFILE_DIR}.{os.getpid()}"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        for rel_path, content in _GOLDEN_PROFILE_FILES.items():
+            path = os.path.join(staging_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(content)
+        try:
+            os.rename(staging_dir, _GOLDEN_PROFILE_DIR)
+        except OSError:
+            # Another process published the skeleton first
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+def _profile_dir_for(account_id: str) -> str:
+    """Path of the account's Chrome user data directory"""
+    return os.path.join(CHROME_PROFILE_ROOT, account_id)
+
+def _seed_profile_dir(account_id: str) -> str:
+    """Create the account's Chrome user data directory from the skeleton"""
+    user_data_dir = _profile_dir_for(account_id)
+    if not os.path.isdir(user_data_dir):
+        _ensure_golden_profile()
+        subprocess.run(['cp', '-a', '--reflink=auto', _GOLDEN_PROFILE_DIR, user_data_dir], check=True)
+    return user_data_dir
+
+# Chrome install and undetected_chromedriver download locations, read ahead into
+# the page cache at startup so the first browser launch does not fault them in
+CHROME_INSTALL_DIR = os.getenv('CHROME_INSTALL_DIR', '/opt/google/chrome')
+_UC_DATA_DIR = os.path.expanduser('~/.local/share/undetected_chromedriver')
+_prewarm_started = False
+
+def _prewarm_browser_binaries():
+    """Hint the kernel to load the Chrome and ChromeDriver files into memory"""
+    paths = glob.glob(os.path.join(CHROME_INSTALL_DIR, '*')) + glob.glob(os.path.join(_UC_DATA_DIR, '*chromedriver*'))
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError as e:
+            logging.debug(f"posix_fadvise failed for {path}: {e}")
+        finally:
+            os.close(fd)
+
+def _start_prewarm():
+    """Prewarm browser binaries in the background, once per process"""
+    global _prewarm_started
+    if _prewarm_started or not hasattr(os, 'posix_fadvise'):
+        return
+    _prewarm_started = True
+    threading.Thread(target=_prewarm_browser_binaries, name='chrome-prewarm', daemon=True).start()
+
+@functools.lru_cache(maxsize=256)
+def _base_chrome_args(language: str, resolution: str) -> Tuple[str, ...]:
+    """Chrome arguments shared by every browser with this language and window size"""
+    return (
+        '--no-sandbox',
+        '--disable-dev-shm-usage',
+        '--disable-blink-features=AutomationControlled',
+        f"--window-size={resolution.replace('x', ',')}",
+        f"--lang={_locale_for(language)}",
+    )
+
+@functools.lru_cache(maxsize=512)
+def _cdp_ua_payload(user_agent: str, platform: str, accept_language: str) -> Dict:
+    """Network.setUserAgentOverride parameters, shared by browsers with the same UA"""
+    return {'userAgent': user_agent, 'platform': platform, 'acceptLanguage': accept_language}
+
+# TikTok signup page locators
+_LOC_PHONE_EMAIL = (By.XPATH, "//div[contains(text(), 'Use phone or email')]")
+_LOC_BIRTH_MONTH = (By.XPATH, "//select[@name='month']")
+_LOC_BIRTH_NEXT = (By.XPATH, "//button[contains(text(), 'Next') or contains(text(), 'Sign up')]")
+_LOC_PHONE_TAB = (By.XPATH, "//div[contains(@class, 'tab-item') and contains(text(), 'Phone')]")
+_LOC_PHONE_INPUT = (By.XPATH, "//input[@type='tel' or @name='phone_number' or @data-tt='phone-number-input']")
+_LOC_PASSWORD_INPUT = (By.XPATH, "//input[@type='password' or @name='password']")
+_LOC_SEND_CODE = (By.XPATH, "//button[contains(text(), 'Send code') or contains(text(), 'Next') or @type='submit']")
+_LOC_CODE_INPUT = (By.XPATH, "//input[@name='code' or @data-tt='verification-code-input']")
+_LOC_SIGNUP_SUBMIT = (By.XPATH, "//button[contains(text(), 'Sign up') or contains(text(), 'Next') or @type='submit']")
+_LOC_USERNAME_INPUT = (By.XPATH, "//input[@placeholder='Username' or @name='unique_id']")
+_LOC_USERNAME_CONFIRM = (By.XPATH, "//button[contains(text(), 'Confirm') or @type='submit']")
+_LOC_CAPTCHA = (By.XPATH, "//*[contains(@class, 'captcha') or contains(@id, 'captcha')]")
+_LOC_UPLOAD_PHOTO = (By.XPATH, "//button[contains(text(), 'Upload photo') or contains(text(), 'Add profile picture')]")
+_LOC_BIO_INPUT = (By.XPATH, "//textarea[@placeholder='Add a bio']")
+_LOC_BIO_SAVE = (By.XPATH, "//button[contains(text(), 'Save') or contains(text(), 'Confirm')]")
+# Password alphabet, sampled from the OS CSPRNG
+PASSWORD_CHARS = string.ascii_letters + string.digits + "!@#$%^&*()"
+_secure_random = secrets.SystemRandom()
+
+# Upper bound on waiting for the next signup step to render
+STEP_TIMEOUT = 15
+# Returns the birthdate <select>s as [month, day, year] in one WebDriver round trip
+_JS_BIRTHDATE_SELECTS = "return ['month', 'day', 'year'].map(n => document.querySelector(`select[name='${n}']`));"
+
+# Anti-detection overrides, filled in with the JSON-encoded browser fingerprint
+_ANTI_DETECTION_JS = """
+(function (fp) {
+    const define = (obj, prop, value) => Object.defineProperty(obj, prop, {get: () => value});
+    // Remove webdriver property
+    define(navigator, 'webdriver', undefined);
+    // Modify navigator properties; userAgent and platform come from the CDP override
+    define(navigator, 'language', fp.language);
+    // Modify screen properties
+    const [width, height] = fp.screen_resolution.split('x').map(Number);
+    define(screen, 'width', width);
+    define(screen, 'height', height);
+    define(screen, 'colorDepth', fp.color_depth);
+    // Simulate plugin and mimeType arrays
+    define(navigator, 'plugins', [1, 2, 3, 4, 5]);
+    define(navigator, 'mimeTypes', [1, 2, 3, 4, 5]);
+})(%s);
+"""
+
+def _type_text(driver: webdriver.Chrome, element, text: str):
+    """Focus `element` and insert `text` in one CDP call instead of a WebDriver command per key"""
+    driver.execute_script("arguments[0].focus();", element)
+    driver.execute_cdp_cmd('Input.insertText', {'text': text})
+
+# Shared async MongoDB client; its connection pool is reused by every manager
+_mongo: Optional[AsyncIOMotorClient] = None
+
+def _get_mongo() -> AsyncIOMotorClient:
+    """Return the shared MongoDB client, creating it on first use"""
+    global _mongo
+    if _mongo is None:
+        _mongo = AsyncIOMotorClient(os.getenv('MONGODB_URL'), maxPoolSize=50, minPoolSize=5)
+    return _mongo
+
+# Shared async Redis client; its connection pool is reused by every manager
+_redis: Optional[aioredis.Redis] = None
+
+def _get_redis() -> aioredis.Redis:
+    """Return the shared Redis client, creating it on first use"""
+    global _redis
+    if _redis is None:
+        _redis = aioredis.Redis(
+            connection_pool=aioredis.ConnectionPool.from_url(os.getenv('REDIS_URL'), max_connections=64)
+        )
+    return _redis
+
+@dataclass(slots=True, frozen=True)
 class AccountProfile:
     """账号配置文件"""
     account_id: str
@@ -32,31 +304,234 @@ class AccountProfile:
     last_active: datetime
     status: str
 
+def _frame_origins(frame_tree: Dict) -> Set[str]:
+    """Web origins of a Page.getFrameTree frame and all of its child frames"""
+    origin = frame_tree['frame'].get('securityOrigin', '')
+    origins = {origin} if origin.startswith(('http://', 'https://')) else set()
+    for child in frame_tree.get('childFrames', []):
+        origins |= _frame_origins(child)
+    return origins
+
+class BrowserPool:
+    """浏览器实例池"""
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_uses: int = BROWSER_MAX_USES):
+        self.size = size
+        self.max_uses = max_uses
+        # Bounds the number of checked-out browsers; together with evicting idle
+        # browsers on a miss this caps the live browsers, and so RAM usage, at `size`
+        self._slots = asyncio.Semaphore(size)
+        self._idle: Dict[Tuple, List[webdriver.Chrome]] = {}
+        # Idle browsers by id in least-recently-released order, for eviction across keys
+        self._idle_lru: "OrderedDict[int, Tuple[Tuple, webdriver.Chrome]]" = OrderedDict()
+        self._live = 0
+        self._keys: Dict[int, Tuple] = {}
+        self._uses: Dict[int, int] = {}
+        self._scripts: Dict[int, List[str]] = {}
+        # Profile directories live on tmpfs, so they are removed with their browser
+        self._profile_dirs: Dict[int, str] = {}
+
+    async def acquire(self, key: Tuple, factory: Callable[[], webdriver.Chrome],
+                      user_data_dir: Optional[str] = None) -> webdriver.Chrome:
+        """Borrow an idle browser matching `key`, launching one via `factory` on a miss;
+        `user_data_dir` is the profile directory the factory launches with"""
+        await self._slots.acquire()
+        try:
+            idle = self._idle.get(key)
+            if idle:
+                driver = idle.pop()
+                self._idle_lru.pop(id(driver), None)
+                return driver
+            evicted = None
+            if self._live >= self.size and self._idle_lru:
+                # At capacity with idle browsers for other keys: make room by
+                # quitting the least recently used one
+                _, (lru_key, evicted) = self._idle_lru.popitem(last=False)
+                self._idle[lru_key].remove(evicted)
+            # Count the new browser before any await so concurrent misses see it
+            self._live += 1
+            try:
+                if evicted is not None:
+                    await self._retire(evicted)
+                driver = await asyncio.to_thread(factory)
+            except BaseException:
+                self._live -= 1
+                if user_data_dir:
+                    shutil.rmtree(user_data_dir, ignore_errors=True)
+                raise
+        except BaseException:
+            self._slots.release()
+            raise
+        self._keys[id(driver)] = key
+        self._uses[id(driver)] = 0
+        if user_data_dir:
+            self._profile_dirs[id(driver)] = user_data_dir
+        return driver
+
+    async def release(self, driver: webdriver.Chrome, discard: bool = False):
+        """Return a browser to the pool, recycling it once it is worn out"""
+        try:
+            key = self._keys.get(id(driver))
+            self._uses[id(driver)] = self._uses.get(id(driver), 0) + 1
+            if discard or key is None or self._uses[id(driver)] >= self.max_uses:
+                await self._retire(driver)
+                return
+            try:
+                await asyncio.to_thread(self._reset, driver)
+            except Exception as e:
+                logging.warning(f"Failed to reset pooled browser, recycling it: {e}")
+                await self._retire(driver)
+                return
+            self._idle.setdefault(key, []).append(driver)
+            self._idle_lru[id(driver)] = (key, driver)
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        """Quit all idle browsers"""
+        drivers = [driver for idle in self._idle.values() for driver in idle]
+        self._idle.clear()
+        self._idle_lru.clear()
+        await asyncio.gather(*(self._retire(driver) for driver in drivers))
+
+    def add_preload_script(self, driver: webdriver.Chrome, source: str):
+        """Run `source` on every new document until the browser is returned to the pool"""
+        result = driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': source})
+        self._scripts.setdefault(id(driver), []).append(result['identifier'])
+
+    def _reset(self, driver: webdriver.Chrome):
+        """Wipe cookies, the HTTP cache, site storage and preload scripts so the next account starts clean"""
+        for identifier in self._scripts.pop(id(driver), []):
+            driver.execute_cdp_cmd('Page.removeScriptToEvaluateOnNewDocument', {'identifier': identifier})
+        # Storage can only be cleared per origin, so collect every origin the session
+        # left data for: open frames (e.g. CAPTCHA iframes) and the domains it set cookies on
+        origins = set(BROWSER_POOL_CLEAR_ORIGINS)
+        origins |= _frame_origins(driver.execute_cdp_cmd('Page.getFrameTree', {})['frameTree'])
+        for cookie in driver.execute_cdp_cmd('Storage.getCookies', {})['cookies']:
+            domain = cookie['domain'].lstrip('.')
+            origins.add(f"https://{domain}")
+            if not cookie.get('secure'):
+                origins.add(f"http://{domain}")
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+        for origin in origins:
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin', {'origin': origin, 'storageTypes': 'all'})
+        driver.get('about:blank')
+
+    async def _retire(self, driver: webdriver.Chrome):
+        """Quit a browser and free its place under the live-browser cap"""
+        if id(driver) in self._keys:
+            self._live -= 1
+        await asyncio.to_thread(self._quit, driver)
+
+    def _quit(self, driver: webdriver.Chrome):
+        self._keys.pop(id(driver), None)
+        self._uses.pop(id(driver), None)
+        self._scripts.pop(id(driver), None)
+        user_data_dir = self._profile_dirs.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.warning(f"Failed to quit browser: {e}")
+        if user_data_dir:
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+
+class BulkWriteBuffer:
+    """MongoDB批量写入缓冲区"""
+
+    def __init__(self, collection, flush_interval: float = BULK_WRITE_INTERVAL,
+                 max_ops: int = BULK_WRITE_MAX_OPS):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.max_ops = max_ops
+        self._write_buffer: List = []
+        self._waiters: List[asyncio.Future] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def write(self, op):
+        """Queue a write operation and wait until the batch containing it is flushed"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._write_buffer.append(op)
+        self._waiters.append(waiter)
+        if len(self._write_buffer) >= self.max_ops:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+        await waiter
+
+    async def flush(self):
+        """Send all pending operations in a single bulk_write"""
+        async with self._flush_lock:
+            ops, waiters = self._write_buffer, self._waiters
+            self._write_buffer, self._waiters = [], []
+            if not ops:
+                return
+            while ops:
+                try:
+                    # Ordered: an update must not be applied before the insert it targets
+                    await self.collection.bulk_write(ops, ordered=True)
+                except BulkWriteError as e:
+                    logging.error(f"Bulk write of {len(ops)} operations failed: {e}")
+                    ops, waiters = self._settle_partial(ops, waiters, e)
+                except Exception as e:
+                    logging.error(f"Bulk write of {len(ops)} operations failed: {e}")
+                    self._settle(waiters, e)
+                    return
+                else:
+                    self._settle(waiters)
+                    return
+
+    @staticmethod
+    def _settle(waiters: List[asyncio.Future], error: Optional[BaseException] = None):
+        """Resolve the waiters, or fail them with `error`"""
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if error is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(error)
+
+    @classmethod
+    def _settle_partial(cls, ops: List, waiters: List[asyncio.Future], error: BulkWriteError):
+        """Settle the operations up to the first failed one; returns the ones still to be sent"""
+        write_errors = error.details.get('writeErrors', [])
+        if not write_errors:
+            # e.g. a write concern error: nothing is known to have succeeded
+            cls._settle(waiters, error)
+            return [], []
+        # An ordered batch stops at its first failed operation; the ones after it never ran
+        # and, since the buffer mixes writes from unrelated accounts, are sent again
+        err = min(write_errors, key=lambda e: e['index'])
+        first_failed = err['index']
+        cls._settle(waiters[:first_failed])
+        cls._settle(waiters[first_failed:first_failed + 1],
+                    OperationFailure(err.get('errmsg'), err.get('code'), err))
+        return ops[first_failed + 1:], waiters[first_failed + 1:]
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
 class AccountIsolationManager:
     """账号隔离管理器"""
     
     def __init__(self):
-        self.mongo = MongoClient(os.getenv('MONGODB_URL'))
-        self.db = self.mongo.tiktok_accounts # Using a specific DB for TikTok accounts
-        self.redis_client = redis.from_url(os.getenv('REDIS_URL'))
-        self.ua = UserAgent()
+        self.db = _get_mongo().tiktok_accounts # Using a specific DB for TikTok accounts
+        self._profile_writes = BulkWriteBuffer(self.db.profiles)
+        self.redis_client = _get_redis()
+        self._seed_proxy_pool = self.redis_client.register_script(_SEED_PROXY_POOL_LUA)
+        self._reserve_proxy = self.redis_client.register_script(_RESERVE_PROXY_LUA)
+        self._release_proxy = self.redis_client.register_script(_RELEASE_PROXY_LUA)
+        self._proxy_pool_loaded = False
+        self.browser_pool = BrowserPool()
+        _start_prewarm()
         
         # Supported language configurations
-        self.supported_languages = {
-            'en': {'name': 'English', 'locale': 'en-US'},
-            'zh': {'name': 'Chinese', 'locale': 'zh-CN'},
-            'ja': {'name': 'Japanese', 'locale': 'ja-JP'},
-            'ko': {'name': 'Korean', 'locale': 'ko-KR'},
-            'es': {'name': 'Spanish', 'locale': 'es-ES'},
-            'fr': {'name': 'French', 'locale': 'fr-FR'},
-            'de': {'name': 'German', 'locale': 'de-DE'},
-            'it': {'name': 'Italian', 'locale': 'it-IT'},
-            'pt': {'name': 'Portuguese', 'locale': 'pt-BR'},
-            'ru': {'name': 'Russian', 'locale': 'ru-RU'},
-            'ar': {'name': 'Arabic', 'locale': 'ar-SA'},
-            'hi': {'name': 'Hindi', 'locale': 'hi-IN'},
-            'th': {'name': 'Thai', 'locale': 'th-TH'}
-        }
+        self.supported_languages = SUPPORTED_LANGUAGES
+        self._lang_keys = tuple(self.supported_languages)
+        self._rng = np.random.default_rng()
 
     async def create_isolated_account(self, user_id: str, account_config: Dict) -> str:
         """创建隔离的账号环境"""
@@ -83,7 +558,11 @@ class AccountIsolationManager:
         )
         
         # Save to database
-        await self._save_account_profile(profile)
+        try:
+            await self._save_account_profile(profile)
+        except Exception:
+            await self.release_proxy(proxy_config)
+            raise
         
         # Initialization of browser environment might not be done here directly, but when `get_browser_instance` is called
         
@@ -92,23 +571,54 @@ class AccountIsolationManager:
     def _generate_browser_fingerprint(self) -> Dict:
         """生成唯一的浏览器指纹"""
         return {
-            'user_agent': self.ua.random,
-            'screen_resolution': random.choice(['1920x1080', '1366x768', '1440x900', '1536x864']),
-            'viewport_size': random.choice(['1200x800', '1366x768', '1440x900']),
-            'color_depth': random.choice([24, 32]),
-            'pixel_ratio': random.choice([1, 1.25, 1.5, 2]),
+            'user_agent': random.choice(USER_AGENTS),
+            'screen_resolution': random.choice(SCREEN_RESOLUTIONS),
+            'viewport_size': random.choice(VIEWPORT_SIZES),
+            'color_depth': random.choice(COLOR_DEPTHS),
+            'pixel_ratio': random.choice(PIXEL_RATIOS),
             'timezone_offset': random.randint(-12, 12),
-            'language': random.choice(list(self.supported_languages.keys())),
-            'platform': random.choice(['Win32', 'MacIntel', 'Linux x86_64']),
-            'webgl_vendor': random.choice(['NVIDIA Corporation', 'AMD', 'Intel Inc.']),
+            'language': random.choice(self._lang_keys),
+            'platform': random.choice(PLATFORMS),
+            'webgl_vendor': random.choice(WEBGL_VENDORS),
             'canvas_fingerprint': self._generate_canvas_fingerprint()
         }
 
+    def generate_fingerprints_batch(self, n: int) -> List[Dict]:
+        """批量生成浏览器指纹"""
+        # Draw every random component for all n fingerprints in one NumPy call each
+        def pick(options: Tuple) -> List:
+            return [options[i] for i in self._rng.integers(len(options), size=n).tolist()]
+
+        user_agents = pick(USER_AGENTS)
+        resolutions = pick(SCREEN_RESOLUTIONS)
+        viewports = pick(VIEWPORT_SIZES)
+        color_depths = pick(COLOR_DEPTHS)
+        pixel_ratios = pick(PIXEL_RATIOS)
+        timezone_offsets = self._rng.integers(-12, 13, size=n).tolist()
+        languages = pick(self._lang_keys)
+        platforms = pick(PLATFORMS)
+        webgl_vendors = pick(WEBGL_VENDORS)
+        canvas = secrets.token_hex(16 * n)
+        
+        return [
+            {
+                'user_agent': user_agents[i],
+                'screen_resolution': resolutions[i],
+                'viewport_size': viewports[i],
+                'color_depth': color_depths[i],
+                'pixel_ratio': pixel_ratios[i],
+                'timezone_offset': timezone_offsets[i],
+                'language': languages[i],
+                'platform': platforms[i],
+                'webgl_vendor': webgl_vendors[i],
+                'canvas_fingerprint': canvas[32 * i:32 * (i + 1)]
+            }
+            for i in range(n)
+        ]
+
     def _generate_canvas_fingerprint(self) -> str:
         """生成Canvas指纹"""
-        import hashlib
-        seed = f"{random.random()}{datetime.now().timestamp()}"
-        return hashlib.md5(seed.encode()).hexdigest()
+        return secrets.token_hex(16)
 
     def _generate_device_info(self) -> Dict:
         """生成模拟的设备信息"""
@@ -120,30 +630,60 @@ class AccountIsolationManager:
 
     async def _assign_proxy(self) -> Dict:
         """分配独立代理"""
-        # In a real system, this would interact with the proxy-manager service
-        # For now, a placeholder assuming proxies are available
-        proxy_list = [
-            {'type': 'http', 'ip': '1.2.3.4', 'port': '8080', 'user': 'user1', 'password': 'password1'},
-            {'type': 'socks5', 'ip': '5.6.7.8', 'port': '1080', 'user': 'user2', 'password': 'password2'}
-        ]
-        if not proxy_list:
-            raise Exception("No available proxies")
-        
-        proxy = random.choice(proxy_list)
+        if not self._proxy_pool_loaded:
+            # Reconcile the usage set with PROXY_POOL once; counts of proxies still in the pool are kept
+            await self._seed_proxy_pool(keys=[PROXY_USAGE_KEY], args=list(_PROXY_MEMBERS))
+            self._proxy_pool_loaded = True
         
-        # This part assumes Redis is accessible and correctly configured to manage proxy usage
-        # await self.redis_client.setex(f"proxy_usage:{proxy['ip']}", 3600, "in_use")
+        reserved = await self._reserve_proxy(keys=[PROXY_USAGE_KEY], args=[MAX_ACCOUNTS_PER_PROXY])
+        if not reserved:
+            raise Exception("No available proxies")
         
-        return proxy
+        return json.loads(reserved)
+
+    async def release_proxy(self, proxy_config: Dict):
+        """释放代理占用"""
+        try:
+            await self._release_proxy(keys=[PROXY_USAGE_KEY], args=[json.dumps(proxy_config, sort_keys=True)])
+        except Exception as e:
+            logging.warning(f"Failed to release proxy {proxy_config.get('ip')}: {e}")
+
+    async def release_account_proxy(self, account_id: str):
+        """释放账号的代理占用"""
+        # Call when an account is discarded or removed; live accounts keep their slot
+        try:
+            profile = await self._get_account_profile(account_id)
+        except Exception as e:
+            logging.warning(f"Failed to load profile {account_id} to release its proxy: {e}")
+            return
+        if profile and profile.get('proxy_config'):
+            await self.release_proxy(profile['proxy_config'])
 
     async def _save_account_profile(self, profile: AccountProfile):
         """保存账号配置文件到MongoDB"""
-        await self.db.profiles.insert_one(profile.__dict__)
+        document = asdict(profile)
+        # Serialize before the insert, which adds an _id to the document
+        cached = orjson.dumps(document, default=str)
+        await self._profile_writes.write(InsertOne(document))
+        # Warm the cache; the browser for a new account is usually requested right away
+        await self.redis_client.setex(f"profile:{profile.account_id}", PROFILE_CACHE_TTL, cached)
         logging.info(f"Account profile {profile.account_id} saved to MongoDB.")
 
     async def _get_account_profile(self, account_id: str) -> Optional[Dict]:
         """从MongoDB获取账号配置文件"""
-        return await self.db.profiles.find_one({'account_id': account_id})
+        cache_key = f"profile:{account_id}"
+        cached = await self.redis_client.get(cache_key)
+        if cached:
+            profile = orjson.loads(cached)
+            # orjson stores datetimes as ISO strings; decode them so hits match what Mongo returns
+            for field in _PROFILE_DATETIME_FIELDS:
+                if isinstance(profile.get(field), str):
+                    profile[field] = datetime.fromisoformat(profile[field])
+            return profile
+        profile = await self.db.profiles.find_one({'account_id': account_id}, {'_id': False})
+        if profile:
+            await self.redis_client.setex(cache_key, PROFILE_CACHE_TTL, orjson.dumps(profile, default=str))
+        return profile
 
     async def get_browser_instance(self, account_id: str) -> webdriver.Chrome:
         """获取账号专用浏览器实例"""
@@ -151,104 +691,83 @@ class AccountIsolationManager:
         if not profile:
             raise Exception(f"Account {account_id} not found")
         
-        # Configure Chrome options
-        options = Options()
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        options.add_argument('--disable-blink-features=AutomationControlled')
-        options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        options.add_experimental_option('useAutomationExtension', False)
-        
-        # Set proxy
+        fingerprint = profile['browser_fingerprint']
+        resolution = fingerprint['screen_resolution']
+        proxy_server = None
         if profile.get('proxy_config'):
             proxy = profile['proxy_config']
-            proxy_string = f"{proxy['ip']}:{proxy['port']}"
-            if proxy.get('user') and proxy.get('password'):
-                # This setup is more complex and typically requires a proxy extension or
-                # setting up the proxy with authentication programmatically.
-                # For simplicity here, just the IP:PORT is used, assuming proxy-manager handles auth.
-                options.add_argument(f"--proxy-server={proxy['type']}://{proxy_string}")
-            else:
-                options.add_argument(f"--proxy-server={proxy['type']}://{proxy_string}")
-        
-        # Set user agent
-        options.add_argument(f"--user-agent={profile['browser_fingerprint']['user_agent']}")
-        
-        # Set window size
-        resolution = profile['browser_fingerprint']['screen_resolution']
-        options.add_argument(f"--window-size={resolution.replace('x', ',')}")
-        
-        # Set language
-        lang = self.supported_languages[profile['language']]['locale']
-        options.add_argument(f"--lang={lang}")
-        
-        # Create isolated user data directory
-        user_data_dir = f"/tmp/chrome_profiles/{account_id}"
-        options.add_argument(f"--user-data-dir={user_data_dir}")
-        
-        # Use undetected_chromedriver to avoid detection
-        driver = uc.Chrome(options=options)
+            proxy_server = f"{proxy['type']}://{proxy['ip']}:{proxy['port']}"
+
+        def launch() -> webdriver.Chrome:
+            # Configure Chrome options
+            options = Options()
+            for arg in _base_chrome_args(profile['language'], resolution):
+                options.add_argument(arg)
+            options.add_experimental_option("excludeSwitches", ["enable-automation"])
+            options.add_experimental_option('useAutomationExtension', False)
+            
+            # Set proxy
+            # Authenticated proxies typically require a proxy extension; just the
+            # IP:PORT is used here, assuming proxy-manager handles auth.
+            if proxy_server:
+                options.add_argument(f"--proxy-server={proxy_server}")
+            
+            # Set user agent
+            options.add_argument(f"--user-agent={fingerprint['user_agent']}")
+            
+            # Create isolated user data directory
+            user_data_dir = _seed_profile_dir(account_id)
+            options.add_argument(f"--user-data-dir={user_data_dir}")
+            
+            # Use undetected_chromedriver to avoid detection
+            return uc.Chrome(options=options)
+
+        # Browsers sharing language, resolution and proxy are interchangeable once
+        # their storage is wiped, so reuse a pooled one instead of a cold start
+        pool_key = (profile['language'], resolution, proxy_server)
+        driver = await self.browser_pool.acquire(pool_key, launch, _profile_dir_for(account_id))
         
         # Apply anti-detection scripts
-        await self._apply_anti_detection(driver, profile['browser_fingerprint'])
+        try:
+            await asyncio.to_thread(
+                self._apply_anti_detection, driver, fingerprint, _locale_for(profile['language'])
+            )
+        except Exception:
+            await self.browser_pool.release(driver, discard=True)
+            raise
         
         return driver
 
-    async def _apply_anti_detection(self, driver: webdriver.Chrome, fingerprint: Dict):
+    async def release_browser_instance(self, driver: webdriver.Chrome, discard: bool = False):
+        """归还浏览器实例"""
+        await self.browser_pool.release(driver, discard=discard)
+
+    def _apply_anti_detection(self, driver: webdriver.Chrome, fingerprint: Dict, locale: str):
         """应用反检测措施"""
-        # Remove webdriver property
-        driver.execute_script("""
-            Object.defineProperty(navigator, 'webdriver', {
-                get: () => undefined,
-            });
-        """)
+        # Pooled browsers keep the UA they were launched with, so override it per checkout;
+        # this also covers navigator.userAgent and navigator.platform natively. Accept-Language
+        # follows the account's locale, as --lang did before pooling
+        driver.execute_cdp_cmd('Network.setUserAgentOverride', _cdp_ua_payload(
+            fingerprint['user_agent'], fingerprint['platform'], locale
+        ))
         
-        # Modify navigator properties
-        driver.execute_script(f"""
-            Object.defineProperty(navigator, 'userAgent', {{
-                get: () => '{fingerprint['user_agent']}',
-            }});
-            Object.defineProperty(navigator, 'platform', {{
-                get: () => '{fingerprint['platform']}',
-            }});
-            Object.defineProperty(navigator, 'language', {{
-                get: () => '{fingerprint['language']}',
-            }});
-        """)
-        
-        # Modify screen properties
-        driver.execute_script(f"""
-            Object.defineProperty(screen, 'width', {{
-                get: () => {fingerprint['screen_resolution'].split('x')[0]},
-            }});
-            Object.defineProperty(screen, 'height', {{
-                get: () => {fingerprint['screen_resolution'].split('x')[1]},
-            }});
-            Object.defineProperty(screen, 'colorDepth', {{
-                get: () => {fingerprint['color_depth']},
-            }});
-        """)
-        
-        # Simulate plugin and mimeType arrays
-        driver.execute_script("""
-            Object.defineProperty(navigator, 'plugins', {
-                get: () => [1, 2, 3, 4, 5], // Simulate some plugins
-            });
-            Object.defineProperty(navigator, 'mimeTypes', {
-                get: () => [1, 2, 3, 4, 5], // Simulate some mime types
-            });
-        """)
+        # Register all overrides as one preload script so they run before any page JS
+        source = _ANTI_DETECTION_JS % json.dumps(fingerprint)
+        self.browser_pool.add_preload_script(driver, source)
 
 class TikTokAccountManager:
     """TikTok账号管理"""
     
     def __init__(self):
         self.isolation_manager = AccountIsolationManager()
-        self.mongo = MongoClient(os.getenv('MONGODB_URL'))
-        self.db = self.mongo.tiktok_accounts # Using a specific DB for TikTok accounts
+        # Selenium calls block, so each registration drives its browser from a worker thread
+        self._executor = ThreadPoolExecutor(max_workers=BROWSER_POOL_SIZE)
+        self.db = self.isolation_manager.db
+        self._tiktok_writes = BulkWriteBuffer(self.db.tiktok_accounts)
         
     async def create_tiktok_account(self, user_id: str, account_config: Dict) -> Dict:
         """创建TikTok账号"""
+        account_id = None
         try:
             # Create isolated environment
             account_id = await self.isolation_manager.create_isolated_account(
@@ -259,15 +778,18 @@ class TikTokAccountManager:
             driver = await self.isolation_manager.get_browser_instance(account_id)
             
             # Execute TikTok registration process
-            tiktok_profile = await self._register_tiktok_account(
-                driver, account_config
-            )
+            try:
+                tiktok_profile = await self._register_tiktok_account(
+                    driver, account_config
+                )
+            except Exception:
+                await self.isolation_manager.release_browser_instance(driver, discard=True)
+                raise
+            await self.isolation_manager.release_browser_instance(driver)
             
             # Save TikTok account information
             await self._save_tiktok_profile(account_id, tiktok_profile)
             
-            driver.quit()
-            
             return {
                 'account_id': account_id,
                 'status': 'created',
@@ -276,24 +798,34 @@ class TikTokAccountManager:
             
         except Exception as e:
             logging.error(f"Failed to create TikTok account: {e}")
+            if account_id is not None:
+                # The account never went live, so it should not count against its proxy
+                await self.isolation_manager.release_account_proxy(account_id)
             return {'status': 'error', 'message': str(e)}
 
     async def _register_tiktok_account(self, driver: webdriver.Chrome, config: Dict) -> Dict:
         """执行TikTok注册流程"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._register_tiktok_account_sync, driver, config
+        )
+
+    def _register_tiktok_account_sync(self, driver: webdriver.Chrome, config: Dict) -> Dict:
+        """Run the blocking WebDriver registration flow on a worker thread"""
         try:
             # Visit TikTok registration page
             driver.get('https://www.tiktok.com/signup')
             
-            # Wait for page to load (adjust as needed)
-            await asyncio.sleep(5)
+            # Wait until any of the possible first steps has rendered
+            self._wait_for_any(driver, _LOC_PHONE_EMAIL, _LOC_BIRTH_MONTH, _LOC_PHONE_INPUT, _LOC_CAPTCHA)
             
             # Try to click on "Use phone or email" if present
             try:
                 phone_email_button = WebDriverWait(driver, 10).until(
-                    EC.element_to_be_clickable((By.XPATH, "//div[contains(text(), 'Use phone or email')]"))
+                    EC.element_to_be_clickable(_LOC_PHONE_EMAIL)
                 )
                 phone_email_button.click()
-                await asyncio.sleep(2)
+                self._wait_for_any(driver, _LOC_BIRTH_MONTH, _LOC_PHONE_TAB, _LOC_PHONE_INPUT)
             except Exception as e:
                 logging.info(f"Phone or email button not found or not clickable immediately, proceeding. {e}")
 
@@ -303,21 +835,17 @@ class TikTokAccountManager:
             # This part will require more specific XPATHs based on actual TikTok signup page
             # For demonstration, using placeholders:
             try:
-                WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.XPATH, "//select[@name='month']"))
-                ).send_keys(random.choice(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
-                WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.XPATH, "//select[@name='day']"))
-                ).send_keys(str(random.randint(1, 28)))
-                WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.XPATH, "//select[@name='year']"))
-                ).send_keys(str(random.randint(1990, 2000))) # Ensure age is above 18
+                WebDriverWait(driver, 10).until(EC.presence_of_element_located(_LOC_BIRTH_MONTH))
+                month_select, day_select, year_select = driver.execute_script(_JS_BIRTHDATE_SELECTS)
+                month_select.send_keys(random.choice(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
+                day_select.send_keys(str(random.randint(1, 28)))
+                year_select.send_keys(str(random.randint(1990, 2000))) # Ensure age is above 18
                 
                 # Click next/submit after birthdate
                 WebDriverWait(driver, 10).until(
-                    EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Next') or contains(text(), 'Sign up')]"))
+                    EC.element_to_be_clickable(_LOC_BIRTH_NEXT)
                 ).click()
-                await asyncio.sleep(3)
+                self._wait_for_any(driver, _LOC_PHONE_TAB, _LOC_PHONE_INPUT)
 
             except Exception as e:
                 logging.warning(f"Could not fill birthdate, might not be prompted or XPATHs changed: {e}")
@@ -326,10 +854,9 @@ class TikTokAccountManager:
             # The XPATH might change; this is a generic attempt
             try:
                 phone_tab_button = WebDriverWait(driver, 10).until(
-                    EC.element_to_be_clickable((By.XPATH, "//div[contains(@class, 'tab-item') and contains(text(), 'Phone')]"))
+                    EC.element_to_be_clickable(_LOC_PHONE_TAB)
                 )
                 phone_tab_button.click()
-                await asyncio.sleep(2)
             except Exception as e:
                 logging.info(f"Phone tab not found or not clickable, assuming direct input. {e}")
 
@@ -340,10 +867,9 @@ class TikTokAccountManager:
             # TikTok often has country code selector, ensure to handle it if needed
             try:
                 phone_input = WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.XPATH, "//input[@type='tel' or @name='phone_number' or @data-tt='phone-number-input']"))
+                    EC.presence_of_element_located(_LOC_PHONE_INPUT)
                 )
-                phone_input.send_keys(phone_number)
-                await asyncio.sleep(1) # Small delay for UI to react
+                _type_text(driver, phone_input, phone_number)
             except Exception as e:
                 logging.error(f"Could not find or input phone number: {e}")
                 raise
@@ -354,11 +880,10 @@ class TikTokAccountManager:
             # Input password (TikTok might ask for password after phone number or separately)
             try:
                 password_input = WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.XPATH, "//input[@type='password' or @name='password']"))
+                    EC.presence_of_element_located(_LOC_PASSWORD_INPUT)
                 )
                 password = self._generate_secure_password()
-                password_input.send_keys(password)
-                await asyncio.sleep(1)
+                _type_text(driver, password_input, password)
             except Exception as e:
                 logging.warning(f"Could not find or input password field: {e}")
                 password = None # Set to None if field not found
@@ -367,28 +892,28 @@ class TikTokAccountManager:
             # Click the 'Send Code' or 'Next' button related to phone/email
             try:
                 send_code_button = WebDriverWait(driver, 10).until(
-                    EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Send code') or contains(text(), 'Next') or @type='submit']"))
+                    EC.element_to_be_clickable(_LOC_SEND_CODE)
                 )
                 send_code_button.click()
-                await asyncio.sleep(5) # Wait for code to be sent and potential captcha
+                # Wait for code to be sent and potential captcha
+                self._wait_for_any(driver, _LOC_CAPTCHA, _LOC_CODE_INPUT, timeout=20)
             except Exception as e:
                 logging.error(f"Could not click 'Send code'/'Next' button: {e}")
                 raise
 
             # Handle CAPTCHA if it appears
-            await self._handle_captcha(driver)
+            self._handle_captcha(driver)
 
             # Input verification code (this part needs integration with an SMS/email verification service)
             # For demonstration, this is a placeholder. In a real system, you'd fetch the code.
             try:
                 verification_code_input = WebDriverWait(driver, 20).until(
-                    EC.presence_of_element_located((By.XPATH, "//input[@name='code' or @data-tt='verification-code-input']"))
+                    EC.presence_of_element_located(_LOC_CODE_INPUT)
                 )
                 # This is where you'd integrate with an SMS/email verification service
                 # For now, a placeholder code
                 fake_code = "123456" 
-                verification_code_input.send_keys(fake_code)
-                await asyncio.sleep(2)
+                _type_text(driver, verification_code_input, fake_code)
             except Exception as e:
                 logging.warning(f"Verification code input not found or cannot be filled: {e}")
                 # If no verification code is requested, this might pass without error
@@ -396,10 +921,10 @@ class TikTokAccountManager:
             # Attempt to click final sign-up/next button if not already done
             try:
                 final_signup_button = WebDriverWait(driver, 10).until(
-                    EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Sign up') or contains(text(), 'Next') or @type='submit']"))
+                    EC.element_to_be_clickable(_LOC_SIGNUP_SUBMIT)
                 )
                 final_signup_button.click()
-                await asyncio.sleep(5)
+                self._wait_for_any(driver, _LOC_USERNAME_INPUT, _LOC_UPLOAD_PHOTO, _LOC_BIO_INPUT)
             except Exception as e:
                 logging.info(f"Final signup button not found or already clicked. {e}")
                 # This can happen if the previous step already completed registration
@@ -407,21 +932,21 @@ class TikTokAccountManager:
             # Attempt to input username if it's a separate step after registration
             try:
                 username_input_after_reg = WebDriverWait(driver, 5).until(
-                    EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Username' or @name='unique_id']"))
+                    EC.presence_of_element_located(_LOC_USERNAME_INPUT)
                 )
                 username_input_after_reg.clear() # Clear any pre-filled value
-                username_input_after_reg.send_keys(username)
+                _type_text(driver, username_input_after_reg, username)
                 
                 # Click confirm for username
                 WebDriverWait(driver, 5).until(
-                    EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Confirm') or @type='submit']"))
+                    EC.element_to_be_clickable(_LOC_USERNAME_CONFIRM)
                 ).click()
-                await asyncio.sleep(2)
+                self._wait_for_any(driver, _LOC_UPLOAD_PHOTO, _LOC_BIO_INPUT, timeout=5)
             except Exception as e:
                 logging.info(f"Username input after registration not found or handled earlier: {e}")
 
             # Complete profile setup (e.g., profile picture, bio)
-            await self._setup_profile(driver, config)
+            self._setup_profile(driver, config)
             
             return {
                 'username': username,
@@ -433,9 +958,21 @@ class TikTokAccountManager:
             
         except Exception as e:
             logging.error(f"TikTok registration failed: {e}")
-            driver.save_screenshot(f"registration_error_{datetime.now().strftime('%Y%m%d%H%M%S')}.png")
+            # pid + monotonic clock keeps names unique across parallel workers
+            driver.save_screenshot(f"registration_error_{os.getpid()}_{time.monotonic_ns()}.png")
             raise
 
+    def _wait_for_any(self, driver: webdriver.Chrome, *locators, timeout: float = STEP_TIMEOUT) -> bool:
+        """Block until any of `locators` is present instead of sleeping a fixed time"""
+        try:
+            WebDriverWait(driver, timeout).until(
+                EC.any_of(*(EC.presence_of_element_located(locator) for locator in locators))
+            )
+            return True
+        except TimeoutException:
+            logging.info(f"None of {len(locators)} expected elements appeared within {timeout}s, proceeding.")
+            return False
+
     def _generate_virtual_phone(self) -> str:
         """生成虚拟手机号 (placeholder)"""
         # In a real system, this would integrate with a virtual phone number service
@@ -449,10 +986,9 @@ class TikTokAccountManager:
 
     def _generate_secure_password(self) -> str:
         """生成安全密码"""
-        chars = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!@#$%^&*()"
-        return "".join(random.choice(chars) for i in range(12))
+        return "".join(_secure_random.choices(PASSWORD_CHARS, k=12))
 
-    async def _handle_captcha(self, driver: webdriver.Chrome):
+    def _handle_captcha(self, driver: webdriver.Chrome):
         """处理验证码 (placeholder)"""
         # This is a complex part. It typically requires:
         # 1. CAPTCHA detection (e.g., check for specific elements, image recognition)
@@ -460,19 +996,15 @@ class TikTokAccountManager:
         # 3. Selenium interaction to input the solved CAPTCHA
         logging.info("Checking for CAPTCHA...")
         # Example: look for a common CAPTCHA element (this will vary greatly)
-        try:
-            captcha_element = WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, "//*[contains(@class, 'captcha') or contains(@id, 'captcha')]"))
-            )
-            logging.warning("CAPTCHA detected! Manual intervention or CAPTCHA solving service required.")
-            # Here you would typically send the image to a solving service and wait for result
-            # For now, it will just pause or raise an error
-            raise Exception("CAPTCHA detected, cannot proceed automatically.")
-        except:
-            logging.info("No CAPTCHA detected or element not found, proceeding.")
-            pass # No CAPTCHA or element not found
+        # The caller already waited for either the CAPTCHA or the next step to render
+        if not driver.find_elements(*_LOC_CAPTCHA):
+            logging.info("No CAPTCHA detected, proceeding.")
+            return
+        # Here you would typically send the image to a solving service and wait for result.
+        # For now registration proceeds and the caller's next step fails on the CAPTCHA
+        logging.warning("CAPTCHA detected! Manual intervention or CAPTCHA solving service required.")
 
-    async def _setup_profile(self, driver: webdriver.Chrome, config: Dict):
+    def _setup_profile(self, driver: webdriver.Chrome, config: Dict):
         """完成个人资料设置 (placeholder)"""
         logging.info("Setting up TikTok profile...")
         # Example: try to add a profile picture or bio if prompts appear
@@ -480,40 +1012,42 @@ class TikTokAccountManager:
         try:
             # Check for profile picture upload prompt
             upload_photo_button = WebDriverWait(driver, 5).until(
-                EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Upload photo') or contains(text(), 'Add profile picture')]"))
+                EC.element_to_be_clickable(_LOC_UPLOAD_PHOTO)
             )
             # You would programmatically upload an image here
             logging.info("Found profile photo upload prompt.")
             # Example: upload a dummy image if available
             # upload_photo_button.send_keys("/path/to/dummy_image.png")
-            # await asyncio.sleep(2)
+            # time.sleep(2)
         except:
             logging.info("No profile photo upload prompt found.")
 
         try:
             # Check for bio input
             bio_input = WebDriverWait(driver, 5).until(
-                EC.presence_of_element_located((By.XPATH, "//textarea[@placeholder='Add a bio']"))
+                EC.presence_of_element_located(_LOC_BIO_INPUT)
             )
-            bio_input.send_keys(config.get('bio', 'Automated content creator.'))
+            _type_text(driver, bio_input, config.get('bio', 'Automated content creator.'))
             logging.info("Filled bio.")
-            await asyncio.sleep(1)
             # Click save/confirm if available
             save_button = WebDriverWait(driver, 5).until(
-                EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Save') or contains(text(), 'Confirm')]"))
+                EC.element_to_be_clickable(_LOC_BIO_SAVE)
             )
             save_button.click()
-            await asyncio.sleep(2)
+            try:
+                WebDriverWait(driver, 5).until(EC.staleness_of(save_button))
+            except TimeoutException:
+                logging.info("Bio dialog still open after saving.")
         except:
             logging.info("No bio input or save button found.")
 
     async def _save_tiktok_profile(self, account_id: str, tiktok_profile: Dict):
         """保存TikTok账号信息到MongoDB"""
-        await self.db.tiktok_accounts.update_one(
+        await self._tiktok_writes.write(UpdateOne(
             {'account_id': account_id},
             {'$set': {'tiktok_profile': tiktok_profile, 'status': 'registered'}},
             upsert=True
-        )
+        ))
         logging.info(f"TikTok profile for account {account_id} saved/updated.")
 
 if __name__ == "__main__":
@@ -534,6 +1068,7 @@ if __name__ == "__main__":
         logging.info(f"Attempting to create TikTok account for user {user_id}")
         result = await manager.create_tiktok_account(user_id, account_config)
         logging.info(f"TikTok account creation result: {result}")
+        await manager.isolation_manager.browser_pool.close()
 
     # Run the test
     asyncio.run(test_account_creation())
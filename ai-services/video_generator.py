@@ -1,31 +1,225 @@
 import asyncio
+import functools
+import json
+import multiprocessing
 import os
-from typing import Dict, List
-from datetime import datetime
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 import openai
+import requests
 from elevenlabs import generate, set_api_key
+from elevenlabs.api.error import RateLimitError as ElevenLabsRateLimitError
 from moviepy.editor import *
+from moviepy.config import get_setting
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import azure.cognitiveservices.speech as speechsdk
+from tenacity import before_sleep_log, retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Hardware H.264 encoders to try, in order of preference; libx264 is the fallback
+HW_H264_ENCODERS = ('h264_nvenc', 'h264_qsv', 'h264_videotoolbox')
+# Encoder-specific write_videofile options, plus the matching ffmpeg hardware decoder input options.
+# pix_fmt is always 8-bit 4:2:0 (QSV only takes it as nv12)
+ENCODER_OPTIONS = {
+    'h264_nvenc': {'preset': 'p4', 'pix_fmt': 'yuv420p', 'ffmpeg_params': ['-rc', 'vbr', '-cq', '23'], 'hwaccel': ['-hwaccel', 'cuda']},
+    'h264_qsv': {'preset': 'faster', 'pix_fmt': 'nv12', 'ffmpeg_params': ['-global_quality', '23'], 'hwaccel': []},
+    'h264_videotoolbox': {'preset': 'medium', 'pix_fmt': 'yuv420p', 'ffmpeg_params': ['-q:v', '65'], 'hwaccel': ['-hwaccel', 'videotoolbox']},
+    'libx264': {'preset': 'ultrafast', 'pix_fmt': 'yuv420p', 'ffmpeg_params': [], 'hwaccel': []},
+}
+
+# JSON mode (response_format) needs a model that supports it
+COPY_MODEL = 'gpt-4-1106-preview'
+
+# Metadata queries go to ffprobe directly instead of opening the file with MoviePy
+FFPROBE_BINARY = os.getenv('FFPROBE_BINARY', 'ffprobe')
+
+# Narration is handed to ffmpeg over stdin; these are the input options for each provider's bytes
+AZURE_AUDIO_INPUT = ['-f', 's16le', '-ar', '24000', '-ac', '1'] # Raw24Khz16BitMonoPcm
+ELEVENLABS_AUDIO_INPUT = ['-f', 'mp3']
+
+# External APIs: at most API_MAX_CONCURRENCY calls in flight per provider; transient
+# errors (rate limits, timeouts) are retried with exponential backoff
+API_MAX_CONCURRENCY = 10
+API_RETRY_ATTEMPTS = 3
+_api_semaphores = {
+    'openai': asyncio.Semaphore(API_MAX_CONCURRENCY),
+    'azure': asyncio.Semaphore(API_MAX_CONCURRENCY),
+    'elevenlabs': asyncio.Semaphore(API_MAX_CONCURRENCY),
+}
+OPENAI_TRANSIENT_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)
+ELEVENLABS_TRANSIENT_ERRORS = (ElevenLabsRateLimitError, requests.Timeout, requests.ConnectionError)
+AZURE_TRANSIENT_ERROR_CODES = frozenset({
+    speechsdk.CancellationErrorCode.TooManyRequests,
+    speechsdk.CancellationErrorCode.ConnectionFailure,
+    speechsdk.CancellationErrorCode.ServiceTimeout,
+    speechsdk.CancellationErrorCode.ServiceUnavailable,
+})
+
+# TikTok output format
+TIKTOK_WIDTH = 1080
+TIKTOK_HEIGHT = 1920
+TIKTOK_FPS = 24
+TIKTOK_BITRATE = '5000k'
+# Large downscales are first reduced by an integer factor, then finished with LANCZOS
+RESIZE_REDUCING_GAP = 3.0
+# Used when a language's configured font is not installed
+FALLBACK_FONT_PATH = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+# Seconds each still image stays on screen
+IMAGE_DURATION = 3
+# Text-only videos: white text centered on black
+TEXT_FRAME_FONT_SIZE = 80
+
+# Subtitle style: yellow text with a black outline, centered, top edge at 80% of the frame height
+SUBTITLE_FONT_SIZE = 40
+SUBTITLE_OUTLINE = 2
+SUBTITLE_MARGIN_V = TIKTOK_HEIGHT - int(TIKTOK_HEIGHT * 0.8) - SUBTITLE_FONT_SIZE
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: {width}
+PlayResY: {height}
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,{font},{size},&H0000FFFF,&H0000FFFF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,{outline},0,2,40,40,{margin_v},1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+# A sentence is a run of text up to and including its terminal punctuation (Latin or CJK);
+# a trailing fragment without punctuation still counts
+SENTENCE_RE = re.compile(r'[^.!?。！？]+[.!?。！？]*')
+
+def _split_sentences(script: str) -> List[str]:
+    """Split a script into non-empty, stripped sentences"""
+    return [s for s in (m.strip() for m in SENTENCE_RE.findall(script)) if s]
+
+class TransientSpeechError(Exception):
+    """Azure Speech synthesis was cancelled for a reason worth retrying"""
+
+def _api_retry(*exception_types):
+    """Retry an async API call on the given transient errors with exponential backoff"""
+    return retry(
+        stop=stop_after_attempt(API_RETRY_ATTEMPTS),
+        wait=wait_exponential(multiplier=1, min=1, max=30),
+        retry=retry_if_exception_type(exception_types),
+        before_sleep=before_sleep_log(logging.getLogger(), logging.WARNING),
+        reraise=True
+    )
+
+async def _run_blocking(func, *args, **kwargs):
+    """Run a blocking call in a worker thread. A thread cannot be interrupted, so when the
+    caller is cancelled, wait for the call to finish before propagating the cancellation"""
+    task = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await asyncio.wait([task])
+        raise
+
+def _ass_timestamp(seconds: float) -> str:
+    """Format seconds as an ASS H:MM:SS.cc timestamp"""
+    centiseconds = int(round(seconds * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    secs, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centiseconds:02d}"
+
+@functools.lru_cache(maxsize=None)
+def _detect_h264_encoder() -> str:
+    """Return the first hardware H.264 encoder that can actually encode a frame here"""
+    ffmpeg = get_setting("FFMPEG_BINARY")
+    for encoder in HW_H264_ENCODERS:
+        # Being listed by `ffmpeg -encoders` does not mean a device is present, so encode a test frame
+        cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-f', 'lavfi', '-i', 'color=c=black:s=256x256',
+               '-frames:v', '1', '-c:v', encoder, '-f', 'null', '-']
+        try:
+            if subprocess.run(cmd, capture_output=True, timeout=30).returncode == 0:
+                logging.info(f"Using hardware H.264 encoder {encoder}")
+                return encoder
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logging.warning(f"Could not probe encoder {encoder}: {e}")
+    logging.info("No hardware H.264 encoder available, using libx264")
+    return 'libx264'
+
+@functools.lru_cache(maxsize=None)
+def _resolve_font_path(font_path: str) -> str:
+    """Return font_path if it exists, otherwise the fallback system font"""
+    if os.path.exists(font_path):
+        return font_path
+    logging.warning(f"Font file not found at {font_path}. Using default.")
+    return FALLBACK_FONT_PATH
+
+@functools.lru_cache(maxsize=32)
+def _load_font(font_path: str, size: int) -> ImageFont.ImageFont:
+    """Load a TrueType font, falling back to Pillow's default font"""
+    try:
+        return ImageFont.truetype(font_path, size)
+    except IOError:
+        logging.error(f"Could not load font from {font_path}. Using default Pillow font.")
+        return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=256)
+def _line_mask(line: str, font_path: str, size: int) -> Tuple[np.ndarray, int, int, float]:
+    """Lay out and rasterize a whole line once; returns its alpha mask, (x, y) offset from the
+    pen position and advance. Laying out the full line keeps kerning, and with raqm, shaping
+    and bidi (Arabic joining, Indic and Thai combining marks)"""
+    font = _load_font(font_path, size)
+    left, top, right, bottom = font.getbbox(line)
+    mask = Image.new('L', (max(right - left, 1), max(bottom - top, 1)))
+    ImageDraw.Draw(mask).text((-left, -top), line, font=font, fill=255)
+    return np.asarray(mask), left, top, font.getlength(line)
+
+def _render_text_frame(line: str, font_path: str) -> np.ndarray:
+    """Render a centered line of white text on black by blitting its cached line mask;
+    returns the single-channel coverage mask (white text: every RGB channel equals it)"""
+    mask, left, top, advance = _line_mask(line, font_path, TEXT_FRAME_FONT_SIZE)
+    ascent, descent = _load_font(font_path, TEXT_FRAME_FONT_SIZE).getmetrics()
+    x = int(round((TIKTOK_WIDTH - advance) / 2)) + left
+    y = (TIKTOK_HEIGHT - ascent - descent) // 2 + top
+
+    canvas = np.zeros((TIKTOK_HEIGHT, TIKTOK_WIDTH), dtype=np.uint8)
+    # Clip lines that overhang the frame edges
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + mask.shape[1], TIKTOK_WIDTH), min(y + mask.shape[0], TIKTOK_HEIGHT)
+    if x0 < x1 and y0 < y1:
+        canvas[y0:y1, x0:x1] = mask[y0 - y:y1 - y, x0 - x:x1 - x]
+    return canvas
+
+# Text frames are CPU-bound, so they are rendered in worker processes (each with its own line cache)
+_frame_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_frame_executor() -> ProcessPoolExecutor:
+    """Return the shared frame-rendering process pool, creating it on first use"""
+    global _frame_executor
+    if _frame_executor is None:
+        # forkserver: the pool is first used while SDK threads are running, and forking a
+        # multi-threaded process can copy a held lock (e.g. logging's) into the worker
+        _frame_executor = ProcessPoolExecutor(
+            max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('forkserver')
+        )
+    return _frame_executor
+
 class AIVideoGenerator:
     """AI视频生成器"""
     
     def __init__(self):
-        openai.api_key = os.getenv('OPENAI_API_KEY')
+        # Retries are handled by _api_retry, so the client's own retry loop is disabled
+        self.openai_client = openai.AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0)
         elevenlabs_api_key = os.getenv('ELEVENLABS_API_KEY')
         if elevenlabs_api_key:
             set_api_key(elevenlabs_api_key)
         
-        self.speech_config = speechsdk.SpeechConfig(
-            subscription=os.getenv('AZURE_SPEECH_KEY'),
-            region=os.getenv('AZURE_SPEECH_REGION')
-        )
+        self.azure_speech_key = os.getenv('AZURE_SPEECH_KEY')
+        self.azure_speech_region = os.getenv('AZURE_SPEECH_REGION')
         
         # Language configurations
         self.language_configs = {
@@ -43,57 +237,95 @@ class AIVideoGenerator:
             'hi': {'voice_azure': 'hi-IN-SwaraNeural', 'voice_elevenlabs': 'Antoni', 'font': 'arial.ttf', 'font_path': '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'},
             'th': {'voice_azure': 'th-TH-PremwadeeNeural', 'voice_elevenlabs': 'Antoni', 'font': 'arial.ttf', 'font_path': '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'}
         }
+        # Font files don't move at runtime: resolve missing ones to the fallback once, and load
+        # the subtitle fonts up front (text frames load theirs in the worker processes)
+        self.fonts = {}
+        for language, lang_config in self.language_configs.items():
+            lang_config['font_path'] = _resolve_font_path(lang_config['font_path'])
+            self.fonts[(language, SUBTITLE_FONT_SIZE)] = _load_font(lang_config['font_path'], SUBTITLE_FONT_SIZE)
         # Ensure fonts are available in the Docker image or mounted
         # For a production system, these font paths should be validated within the container.
 
+        # Probe for a hardware encoder once, up front
+        _detect_h264_encoder()
+
+    def _hwaccel_params(self) -> Dict:
+        """write_videofile options for the fastest available H.264 encoder"""
+        encoder = _detect_h264_encoder()
+        options = ENCODER_OPTIONS[encoder]
+        return {
+            'codec': encoder,
+            'audio_codec': 'aac',
+            'preset': options['preset'],
+            # MoviePy only sets a pixel format for libx264; without it RGB input can end up as 4:4:4
+            'ffmpeg_params': ['-pix_fmt', options['pix_fmt'], *options['ffmpeg_params']],
+            'threads': os.cpu_count()
+        }
+
+    def _encoder_args(self) -> List[str]:
+        """ffmpeg command-line video encoder arguments matching _hwaccel_params"""
+        params = self._hwaccel_params()
+        return ['-c:v', params['codec'], '-preset', params['preset'], *params['ffmpeg_params'],
+                '-threads', str(params['threads'])]
+
+    def _decoder_args(self) -> List[str]:
+        """ffmpeg input options that decode on the same device as the selected encoder"""
+        # Decoded frames are copied back to system memory for the CPU filters (subtitles);
+        # ffmpeg falls back to software decoding for codecs the device cannot handle
+        return list(ENCODER_OPTIONS[_detect_h264_encoder()]['hwaccel'])
+
 
     async def generate_video_from_material(self, material_path: str, config: Dict) -> Dict:
         """根据素材生成视频"""
         try:
-            # Analyze uploaded material
-            material_analysis = await self._analyze_material(material_path)
-            
-            # Generate script
-            script = await self._generate_script(material_analysis, config['language'])
-            
-            # Generate audio
-            audio_path = await self._generate_audio(script, config['language'])
-            
-            # Process visual content
-            if material_analysis['type'] == 'image':
-                video_path = await self._create_video_from_images(
-                    [material_path], script, config
-                )
-            elif material_analysis['type'] == 'video':
-                video_path = await self._enhance_existing_video(
-                    material_path, script, config
+            # Intermediate files live in a per-request directory that is removed afterwards
+            with tempfile.TemporaryDirectory(prefix='video_') as work_dir:
+                # Analyze uploaded material
+                material_analysis = await self._analyze_material(material_path)
+                
+                # Generate script, hashtags and title in one request
+                copy = await self._generate_copy(material_analysis, config['language'])
+                script = copy['script']
+                
+                # Synthesize narration while the visuals are being built; both only need the script.
+                # A TaskGroup cancels the other branch on failure, so nothing is still writing
+                # into work_dir when it is removed
+                try:
+                    async with asyncio.TaskGroup() as tg:
+                        audio_task = tg.create_task(self._generate_audio(script, config['language']))
+                        video_task = tg.create_task(
+                            self._create_visual(material_path, material_analysis, script, config, work_dir)
+                        )
+                except ExceptionGroup as eg:
+                    raise eg.exceptions[0]
+                audio, video_path = audio_task.result(), video_task.result()
+                
+                # Merge audio, burn in subtitles and encode for TikTok in one pass
+                optimized_video_path = await self._render_final_video(
+                    video_path, audio, script, config['language'], work_dir
                 )
-            else: # Fallback to text-only video if material is not image/video
-                video_path = await self._create_text_video(script, config)
-            
-            # Merge audio and video
-            final_video_path_no_subtitles = await self._merge_audio_video(video_path, audio_path)
-            
-            # Add subtitles
-            subtitled_video_path = await self._add_subtitles(
-                final_video_path_no_subtitles, script, config['language']
-            )
-            
-            # Optimize output format for TikTok
-            optimized_video_path = await self._optimize_for_tiktok(subtitled_video_path)
             
             return {
                 'video_path': optimized_video_path,
                 'script': script,
                 'duration': await self._get_video_duration(optimized_video_path),
-                'hashtags': await self._generate_hashtags(script, config['language']),
-                'title': await self._generate_title(script, config['language'])
+                'hashtags': copy['hashtags'],
+                'title': copy['title']
             }
             
         except Exception as e:
             logging.error(f"Error generating video: {e}", exc_info=True)
             return {'error': str(e)}
 
+    async def _create_visual(self, material_path: str, material_analysis: Dict, script: str, config: Dict, work_dir: str) -> str:
+        """Build the silent video track for the material"""
+        if material_analysis['type'] == 'image':
+            return await self._create_video_from_images([material_path], script, config, work_dir)
+        elif material_analysis['type'] == 'video':
+            return await self._enhance_existing_video(material_path, script, config, work_dir)
+        else: # Fallback to text-only video if material is not image/video
+            return await self._create_text_video(script, config, work_dir)
+
     async def _analyze_material(self, material_path: str) -> Dict:
         """Analyze uploaded material (image/video) to extract key features."""
         # Placeholder for actual analysis (e.g., using vision APIs or local ML models)
@@ -118,109 +350,158 @@ class AIVideoGenerator:
             }
 
 
-    async def _generate_script(self, material_analysis: Dict, language: str) -> str:
-        """生成文案"""
+    async def _generate_copy(self, material_analysis: Dict, language: str) -> Dict:
+        """生成文案、话题标签和标题"""
         prompt = f"""
-        Based on the following material analysis, generate an engaging TikTok video script for {language} speakers.
+        Based on the following material analysis, write the copy for an engaging TikTok video for {language} speakers.
         
         Material Type: {material_analysis['type']}
         Content Description: {material_analysis['description']}
         Key Elements: {', '.join(material_analysis['key_elements'])}
         
-        Requirements:
-        1. Script length 15-30 seconds, suitable for narration.
-        2. Must have an engaging hook at the beginning.
-        3. Content should be interesting and relevant.
-        4. Culturally appropriate for {language}.
-        5. Optimized for short-form video platforms.
+        Respond with a JSON object with exactly these keys:
+        - "script": the narration script.
+          1. Script length 15-30 seconds, suitable for narration.
+          2. Must have an engaging hook at the beginning.
+          3. Content should be interesting and relevant.
+          4. Culturally appropriate for {language}.
+          5. Optimized for short-form video platforms.
+        - "hashtags": a list of 5-10 highly relevant and trending hashtags for the script, mixing general and niche ones.
+        - "title": a catchy, intriguing title for the video, under 25 characters.
         """
         
+        copy = {
+            'script': "Here's a great video for you!", # Fallback script
+            'hashtags': ["#TikTokViral", "#ForYou", "#AIContent"],
+            'title': "Watch This Now!"
+        }
         try:
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-4",
+            response = await self._chat_completion(
+                model=COPY_MODEL,
                 messages=[{"role": "user", "content": prompt}],
-                max_tokens=300,
+                response_format={"type": "json_object"},
+                max_tokens=500,
                 temperature=0.7
             )
-            
-            return response.choices[0].message.content.strip()
+            result = json.loads(response.choices[0].message.content)
         except Exception as e:
-            logging.error(f"Error generating script with OpenAI: {e}", exc_info=True)
-            return "Here's a great video for you!" # Fallback script
-
-    async def _generate_audio(self, text: str, language: str) -> str:
+            logging.error(f"Error generating copy with OpenAI: {e}", exc_info=True)
+            return copy
+
+        if isinstance(result.get('script'), str) and result['script'].strip():
+            copy['script'] = result['script'].strip()
+        if isinstance(result.get('hashtags'), list):
+            hashtags = [str(h).replace('#', '').strip() for h in result['hashtags']]
+            copy['hashtags'] = [h for h in hashtags if h] or copy['hashtags']
+        if isinstance(result.get('title'), str) and result['title'].strip():
+            copy['title'] = result['title'].strip()[:25] # Truncate to 25 characters
+        return copy
+
+    @_api_retry(*OPENAI_TRANSIENT_ERRORS)
+    async def _chat_completion(self, **kwargs):
+        """OpenAI chat completion, throttled and retried on transient errors"""
+        async with _api_semaphores['openai']:
+            return await self.openai_client.chat.completions.create(**kwargs)
+
+    async def _generate_audio(self, text: str, language: str) -> Tuple[bytes, List[str]]:
         """生成多语言语音"""
-        audio_path = f"/tmp/audio_{datetime.now().timestamp()}_{random.randint(1000, 9999)}.mp3"
+        # Race both providers and keep whichever finishes first; returns the audio bytes
+        # and the ffmpeg input options describing them
+        providers = {
+            asyncio.create_task(self._azure_tts(text, language)): 'Azure Speech',
+            asyncio.create_task(self._elevenlabs_tts(text, language)): 'ElevenLabs',
+        }
+        pending = set(providers)
+        errors = []
         try:
-            voice_config = self.language_configs[language]['voice_azure']
-            
-            # Use Azure Speech Service
-            self.speech_config.speech_synthesis_voice_name = voice_config
-            audio_config = speechsdk.audio.AudioOutputConfig(filename=audio_path)
-            synthesizer = speechsdk.SpeechSynthesizer(
-                speech_config=self.speech_config,
-                audio_config=audio_config
-            )
-            
-            result = synthesizer.speak_text_async(text).get()
-            
-            if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-                logging.info(f"Azure Speech Synthesis completed. Audio saved to {audio_path}")
-                return audio_path
-            else:
-                logging.error(f"Azure Speech synthesis failed: {result.reason}. Trying ElevenLabs.")
-                raise Exception(f"Azure Speech synthesis failed: {result.reason}")
-                
-        except Exception as e:
-            logging.warning(f"Failed with Azure Speech: {e}. Falling back to ElevenLabs.")
-            try:
-                # Fallback to ElevenLabs
-                elevenlabs_voice = self.language_configs[language]['voice_elevenlabs']
-                audio = generate(
-                    text=text,
-                    voice=elevenlabs_voice,
-                    model="eleven_multilingual_v2"
-                )
-                
-                with open(audio_path, "wb") as audio_file:
-                    audio_file.write(audio)
-                logging.info(f"ElevenLabs audio generated and saved to {audio_path}")
-                return audio_path
-            except Exception as eleven_e:
-                logging.error(f"Both Azure and ElevenLabs failed to generate audio: {eleven_e}", exc_info=True)
-                raise Exception(f"Failed to generate audio: {eleven_e}")
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        audio = task.result()
+                    except Exception as e:
+                        logging.warning(f"Failed with {providers[task]}: {e}")
+                        errors.append(f"{providers[task]}: {e}")
+                        continue
+                    logging.info(f"{providers[task]} audio generated ({len(audio[0])} bytes)")
+                    return audio
+        finally:
+            for task in pending:
+                task.cancel()
+        logging.error(f"Both Azure and ElevenLabs failed to generate audio: {errors}")
+        raise Exception(f"Failed to generate audio: {'; '.join(errors)}")
+
+    @_api_retry(TransientSpeechError)
+    async def _azure_tts(self, text: str, language: str) -> Tuple[bytes, List[str]]:
+        """Azure Speech synthesis in a worker thread, throttled and retried on transient errors"""
+        async with _api_semaphores['azure']:
+            return await asyncio.to_thread(self._synthesize_azure, text, language)
+
+    @_api_retry(*ELEVENLABS_TRANSIENT_ERRORS)
+    async def _elevenlabs_tts(self, text: str, language: str) -> Tuple[bytes, List[str]]:
+        """ElevenLabs synthesis in a worker thread, throttled and retried on transient errors"""
+        async with _api_semaphores['elevenlabs']:
+            return await asyncio.to_thread(self._synthesize_elevenlabs, text, language)
+
+    def _synthesize_azure(self, text: str, language: str) -> Tuple[bytes, List[str]]:
+        """Synthesize speech with Azure Speech Service into memory (blocking)"""
+        # A config per call: synthesis runs in worker threads, so a shared config's voice could be
+        # switched by another request before this synthesizer is built
+        speech_config = speechsdk.SpeechConfig(
+            subscription=self.azure_speech_key,
+            region=self.azure_speech_region
+        )
+        speech_config.speech_synthesis_voice_name = self.language_configs[language]['voice_azure']
+        # Raw PCM can be piped straight into ffmpeg without an encode/decode round trip
+        speech_config.set_speech_synthesis_output_format(
+            speechsdk.SpeechSynthesisOutputFormat.Raw24Khz16BitMonoPcm
+        )
+        # Without an audio config the synthesized audio is only returned in result.audio_data
+        synthesizer = speechsdk.SpeechSynthesizer(
+            speech_config=speech_config,
+            audio_config=None
+        )
+        
+        result = synthesizer.speak_text_async(text).get()
+        if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+            details = result.cancellation_details
+            if details is not None and details.error_code in AZURE_TRANSIENT_ERROR_CODES:
+                raise TransientSpeechError(f"Azure Speech synthesis cancelled: {details.error_code} {details.error_details}")
+            raise Exception(f"Azure Speech synthesis failed: {result.reason}")
+        return result.audio_data, AZURE_AUDIO_INPUT
+
+    def _synthesize_elevenlabs(self, text: str, language: str) -> Tuple[bytes, List[str]]:
+        """Synthesize speech with ElevenLabs into memory (blocking)"""
+        audio = generate(
+            text=text,
+            voice=self.language_configs[language]['voice_elevenlabs'],
+            model="eleven_multilingual_v2"
+        )
+        return audio, ELEVENLABS_AUDIO_INPUT
 
     def _resize_for_tiktok(self, image: Image.Image) -> Image.Image:
         """Resize image to TikTok's common 9:16 aspect ratio (1080x1920)"""
-        target_width = 1080
-        target_height = 1920
-        
         original_width, original_height = image.size
-        original_aspect = original_width / original_height
-        target_aspect = target_width / target_height
-
-        if original_aspect > target_aspect:
-            # Original is wider, fit by height and crop width
-            new_height = target_height
-            new_width = int(new_height * original_aspect)
-            resized_image = image.resize((new_width, new_height), Image.LANCZOS)
-            left = (new_width - target_width) / 2
-            top = 0
-            right = (new_width + target_width) / 2
-            bottom = target_height
-            cropped_image = resized_image.crop((left, top, right, bottom))
-            return cropped_image
+        target_aspect = TIKTOK_WIDTH / TIKTOK_HEIGHT
+
+        # Centered source region with the target aspect ratio, cropped as part of the resize
+        # (same result as ImageOps.fit, which does not accept reducing_gap)
+        if original_width / original_height > target_aspect:
+            # Original is wider, crop width
+            crop_width = original_height * target_aspect
+            left = (original_width - crop_width) / 2
+            box = (left, 0, left + crop_width, original_height)
         else:
-            # Original is taller or same aspect, fit by width and crop height
-            new_width = target_width
-            new_height = int(new_width / original_aspect)
-            resized_image = image.resize((new_width, new_height), Image.LANCZOS)
-            left = 0
-            top = (new_height - target_height) / 2
-            right = target_width
-            bottom = (new_height + target_height) / 2
-            cropped_image = resized_image.crop((left, top, right, bottom))
-            return cropped_image
+            # Original is taller or same aspect, crop height
+            crop_height = original_width / target_aspect
+            top = (original_height - crop_height) / 2
+            box = (0, top, original_width, top + crop_height)
+        return image.resize((TIKTOK_WIDTH, TIKTOK_HEIGHT), Image.Resampling.LANCZOS,
+                            box=box, reducing_gap=RESIZE_REDUCING_GAP)
+
+    def _load_for_tiktok(self, image_path: str) -> Image.Image:
+        """Open an image as RGB and resize it for TikTok (blocking)"""
+        return self._resize_for_tiktok(Image.open(image_path).convert("RGB"))
 
     async def _add_image_effects(self, image: Image.Image, config: Dict) -> Image.Image:
         """Add dynamic effects to an image (e.g., zoom, pan)"""
@@ -230,31 +511,43 @@ class AIVideoGenerator:
         logging.info("Applying image effects (placeholder).")
         return image
 
-    async def _create_video_from_images(self, image_paths: List[str], script: str, config: Dict) -> str:
+    async def _create_video_from_images(self, image_paths: List[str], script: str, config: Dict, work_dir: str) -> str:
         """从图片创建视频"""
-        clips = []
-        
-        for img_path in image_paths:
-            img = Image.open(img_path).convert("RGB") # Ensure RGB mode
-            img_resized = self._resize_for_tiktok(img)
-            img_with_effects = await self._add_image_effects(img_resized, config)
-            
-            temp_path = f"/tmp/temp_frame_{datetime.now().timestamp()}_{random.randint(1000, 9999)}.png"
-            img_with_effects.save(temp_path)
-            
-            clip = ImageClip(temp_path).set_duration(3) # Each image shown for 3 seconds
-            clips.append(clip)
-        
-        if not clips:
-            raise ValueError("No image clips to concatenate.")
-
-        final_video_clip = concatenate_videoclips(clips, method="compose")
-        output_path = f"/tmp/video_{datetime.now().timestamp()}_{random.randint(1000, 9999)}.mp4"
-        final_video_clip.write_videofile(output_path, fps=24) # Ensure fps is set
+        frames_dir = os.path.join(work_dir, 'frames')
+        os.makedirs(frames_dir)
+        try:
+            # Decoding and resizing are blocking Pillow work; keep them off the event loop
+            images = await asyncio.gather(*(asyncio.to_thread(self._load_for_tiktok, p) for p in image_paths))
+            concat_lines = []
+            for i, img_resized in enumerate(images):
+                img_with_effects = await self._add_image_effects(img_resized, config)
+
+                frame_path = os.path.join(frames_dir, f"frame_{i:04d}.png")
+                # Read back once by ffmpeg, favour speed
+                await _run_blocking(img_with_effects.save, frame_path, compress_level=1)
+                concat_lines.append(f"file '{frame_path}'\nduration {IMAGE_DURATION}\n")
+
+            if not concat_lines:
+                raise ValueError("No image clips to concatenate.")
+            # The concat demuxer ignores the last entry's duration unless its file is listed again
+            concat_lines.append(f"file '{frame_path}'\n")
+            concat_path = os.path.join(frames_dir, 'concat.txt')
+            with open(concat_path, 'w') as f:
+                f.writelines(concat_lines)
+
+            output_path = os.path.join(work_dir, 'video.mp4')
+            # One encoded frame per image; the final render resamples to TIKTOK_FPS
+            await self._run_ffmpeg([
+                '-f', 'concat', '-safe', '0', '-i', concat_path,
+                '-vsync', 'vfr', *self._encoder_args(),
+                output_path
+            ], "create video from images")
+        finally:
+            shutil.rmtree(frames_dir, ignore_errors=True)
         logging.info(f"Video from images created: {output_path}")
         return output_path
 
-    async def _enhance_existing_video(self, video_path: str, script: str, config: Dict) -> str:
+    async def _enhance_existing_video(self, video_path: str, script: str, config: Dict, work_dir: str) -> str:
         """Enhance existing video (e.g., cut, add B-roll, visual effects)"""
         # Placeholder for complex video enhancement. This might involve:
         # - Scene detection and intelligent cutting
@@ -262,205 +555,129 @@ class AIVideoGenerator:
         # - Applying filters/color grading
         logging.info(f"Enhancing existing video (placeholder): {video_path}")
         # For now, just copy the video
-        output_path = f"/tmp/enhanced_video_{datetime.now().timestamp()}_{random.randint(1000, 9999)}.mp4"
-        shutil.copy(video_path, output_path)
+        output_path = os.path.join(work_dir, 'enhanced_video.mp4')
+        await _run_blocking(shutil.copy, video_path, output_path)
         return output_path
 
-    async def _create_text_video(self, script: str, config: Dict) -> str:
+    async def _create_text_video(self, script: str, config: Dict, work_dir: str) -> str:
         """Create a video composed mainly of text on a background."""
         logging.info("Creating text-based video.")
-        lines = script.split('.') # Simple split for demonstration
-        clips = []
+        lines = _split_sentences(script)
         duration_per_line = 2 # seconds per line
         
         font_path = self.language_configs[config['language']]['font_path']
-        if not os.path.exists(font_path):
-             logging.warning(f"Font file not found at {font_path}. Using default.")
-             font_path = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf' # Fallback to a common system font
 
-        for i, line in enumerate(lines):
-            if not line.strip():
-                continue
-            
-            # Create a blank black image
-            img = Image.new('RGB', (1080, 1920), color = (0, 0, 0))
-            d = ImageDraw.Draw(img)
-            
-            try:
-                fnt = ImageFont.truetype(font_path, 80)
-            except IOError:
-                logging.error(f"Could not load font from {font_path}. Using default Pillow font.")
-                fnt = ImageFont.load_default()
-
-            text_color = "white"
-            stroke_color = "black"
-            stroke_width = 3
-
-            # Calculate text size
-            bbox = d.textbbox((0,0), line.strip(), font=fnt)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-
-            # Center the text
-            x = (img.width - text_width) / 2
-            y = (img.height - text_height) / 2
-
-            d.text((x, y), line.strip(), font=fnt, fill=text_color, stroke_width=stroke_width, stroke_fill=stroke_color, align="center")
-            
-            temp_path = f"/tmp/text_frame_{datetime.now().timestamp()}_{i}_{random.randint(1000, 9999)}.png"
-            img.save(temp_path)
-            clip = ImageClip(temp_path).set_duration(duration_per_line)
-            clips.append(clip)
+        # Render all lines in parallel; gather keeps them in script order
+        loop = asyncio.get_running_loop()
+        executor = _get_frame_executor()
+        frames = await asyncio.gather(*(
+            loop.run_in_executor(executor, _render_text_frame, line, font_path) for line in lines
+        ))
+        # Workers send back one channel (a third of the bytes); expand to RGB here
+        clips = [
+            ImageClip(np.repeat(mask[:, :, np.newaxis], 3, axis=2)).set_duration(duration_per_line)
+            for mask in frames
+        ]
             
         if not clips:
             raise ValueError("No text clips to concatenate.")
 
-        final_video_clip = concatenate_videoclips(clips, method="compose")
-        output_path = f"/tmp/text_video_{datetime.now().timestamp()}_{random.randint(1000, 9999)}.mp4"
-        final_video_clip.write_videofile(output_path, fps=24)
+        # Every frame is full-size, so chaining avoids compositing each frame onto a background
+        final_video_clip = concatenate_videoclips(clips, method="chain")
+        output_path = os.path.join(work_dir, 'text_video.mp4')
+        # MoviePy composes and pipes every frame from Python; run it in a worker thread
+        await _run_blocking(final_video_clip.write_videofile, output_path, fps=24, **self._hwaccel_params())
         logging.info(f"Text video created: {output_path}")
         return output_path
 
-    async def _merge_audio_video(self, video_path: str, audio_path: str) -> str:
-        """Merge generated audio with the video."""
-        logging.info(f"Merging audio {audio_path} with video {video_path}")
-        video_clip = VideoFileClip(video_path)
-        audio_clip = AudioFileClip(audio_path)
-        
-        # Adjust video duration to match audio if audio is shorter, or vice-versa
-        if audio_clip.duration < video_clip.duration:
-            video_clip = video_clip.set_duration(audio_clip.duration)
-        elif audio_clip.duration > video_clip.duration:
-            # If audio is longer, loop video or extend static image at end
-            # For simplicity, just set video duration to audio duration for now (will cut video if shorter)
-            video_clip = video_clip.set_duration(audio_clip.duration) 
-
-        final_clip = video_clip.set_audio(audio_clip)
-        output_path = f"/tmp/merged_video_{datetime.now().timestamp()}_{random.randint(1000, 9999)}.mp4"
-        final_clip.write_videofile(output_path, fps=final_clip.fps)
-        logging.info(f"Audio and video merged: {output_path}")
-        return output_path
-
-    async def _add_subtitles(self, video_path: str, script: str, language: str) -> str:
-        """Add dynamic subtitles to the video."""
-        logging.info(f"Adding subtitles to {video_path}")
-        video = VideoFileClip(video_path)
-        
+    def _write_subtitle_file(self, script: str, language: str, work_dir: str) -> Tuple[str, str]:
+        """Write the script as timed ASS subtitles; returns the file path and its fonts directory."""
         font_path = self.language_configs[language]['font_path']
-        if not os.path.exists(font_path):
-             logging.warning(f"Font file not found at {font_path}. Using default.")
-             font_path = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf' # Fallback
+        font_name = self.fonts[(language, SUBTITLE_FONT_SIZE)].getname()[0]
 
         # Simple subtitle generation (each sentence appears for a calculated duration)
-        sentences = [s.strip() for s in script.split('.') if s.strip()]
-        
-        text_clips = []
-        current_time = 0
-        for sentence in sentences:
-            # Estimate duration based on characters or words per second
-            # A more advanced approach would use actual audio timing for precise sync
-            duration = max(len(sentence) * 0.1, 2) # At least 2 seconds, roughly 10 chars/sec
-            
-            txt_clip = TextClip(sentence, fontsize=40, color='yellow', font=font_path,
-                                stroke_color='black', stroke_width=2).set_position(('center', 0.8), relative=True)
-            txt_clip = txt_clip.set_start(current_time).set_duration(duration)
-            text_clips.append(txt_clip)
-            current_time += duration
-        
-        if text_clips:
-            final_clip = CompositeVideoClip([video] + text_clips)
-        else:
-            final_clip = video
-
-        output_path = f"/tmp/subtitled_video_{datetime.now().timestamp()}_{random.randint(1000, 9999)}.mp4"
-        final_clip.write_videofile(output_path, fps=video.fps)
-        logging.info(f"Subtitled video created: {output_path}")
-        return output_path
-
-
-    async def _optimize_for_tiktok(self, video_path: str) -> str:
-        """Optimize video for TikTok (e.g., resolution, bitrate, format)."""
-        logging.info(f"Optimizing video {video_path} for TikTok.")
-        # TikTok recommends 720p to 1080p, 9:16 aspect ratio, H.264 codec.
-        # MoviePy's default output is generally good, but we can re-encode for specific bitrate.
-        clip = VideoFileClip(video_path)
-        
-        # Ensure correct resolution if not already set
-        if clip.w != 1080 or clip.h != 1920:
-             clip = clip.resize((1080, 1920))
-
-        output_path = f"/tmp/tiktok_optimized_video_{datetime.now().timestamp()}_{random.randint(1000, 9999)}.mp4"
-        clip.write_videofile(
-            output_path, 
-            codec="libx264", 
-            audio_codec="aac", 
-            bitrate="5000k", # Adjust bitrate as needed for quality vs. file size
-            fps=24 # Common frame rate for TikTok
+        sentences = _split_sentences(script)
+        # Estimate duration based on characters or words per second
+        # A more advanced approach would use actual audio timing for precise sync
+        durations = np.maximum(np.fromiter(map(len, sentences), dtype=np.float64, count=len(sentences)) * 0.1, 2.0) # At least 2 seconds, roughly 10 chars/sec
+        ends = np.cumsum(durations)
+        starts = ends - durations
+
+        lines = [ASS_HEADER.format(width=TIKTOK_WIDTH, height=TIKTOK_HEIGHT, font=font_name,
+                                   size=SUBTITLE_FONT_SIZE, outline=SUBTITLE_OUTLINE, margin_v=SUBTITLE_MARGIN_V)]
+        for sentence, start, end in zip(sentences, starts.tolist(), ends.tolist()):
+            text = sentence.replace('{', '(').replace('}', ')').replace('\n', '\\N')
+            lines.append(f"Dialogue: 0,{_ass_timestamp(start)},{_ass_timestamp(end)},Default,,0,0,0,,{text}\n")
+
+        subtitle_path = os.path.join(work_dir, 'subtitles.ass')
+        with open(subtitle_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        return subtitle_path, os.path.dirname(font_path)
+
+    async def _render_final_video(self, video_path: str, audio: Tuple[bytes, List[str]], script: str, language: str, work_dir: str) -> str:
+        """Merge audio, burn in subtitles and encode for TikTok with a single ffmpeg pass."""
+        logging.info(f"Rendering final video from {video_path}")
+        audio_data, audio_input = audio
+        subtitle_path, fonts_dir = self._write_subtitle_file(script, language, work_dir)
+        rendered_path = os.path.join(work_dir, 'tiktok_optimized_video.mp4')
+
+        # Hold the last frame if the audio runs longer; -shortest then cuts the video at the audio's end
+        video_filter = (
+            f"[0:v]tpad=stop_mode=clone:stop=-1,"
+            f"scale={TIKTOK_WIDTH}:{TIKTOK_HEIGHT}:force_original_aspect_ratio=increase,"
+            f"crop={TIKTOK_WIDTH}:{TIKTOK_HEIGHT},fps={TIKTOK_FPS},"
+            f"subtitles=filename={subtitle_path}:fontsdir={fonts_dir},format=yuv420p[v]"
         )
+        args = [
+            *self._decoder_args(), '-i', video_path,
+            *audio_input, '-i', 'pipe:0',
+            '-filter_complex', video_filter,
+            '-map', '[v]', '-map', '1:a',
+            *self._encoder_args(), '-b:v', TIKTOK_BITRATE,
+            '-c:a', 'aac', '-shortest', '-movflags', '+faststart',
+            rendered_path
+        ]
+        await self._run_ffmpeg(args, "render final video", input_data=audio_data)
+
+        # The work directory is removed after the request; move the finished video out of it
+        # (rename within the temp filesystem, so it appears atomically)
+        fd, output_path = tempfile.mkstemp(prefix='tiktok_optimized_video_', suffix='.mp4')
+        os.close(fd)
+        os.replace(rendered_path, output_path)
         logging.info(f"TikTok optimized video saved to {output_path}")
         return output_path
 
-    async def _get_video_duration(self, video_path: str) -> float:
-        """Get video duration in seconds."""
-        clip = VideoFileClip(video_path)
-        duration = clip.duration
-        clip.close()
-        return duration
-
-    async def _generate_hashtags(self, script: str, language: str) -> List[str]:
-        """Generate relevant hashtags based on the script."""
-        prompt = f"""
-        Generate 5-10 highly relevant and trending hashtags for a TikTok video based on the following script, for {language} audience:
-        
-        Script: {script}
-        
-        Requirements:
-        1. Only provide hashtags, no other text.
-        2. Hashtags should be concise and popular.
-        3. Include general and niche hashtags.
-        """
+    async def _run_ffmpeg(self, args: List[str], description: str, input_data: bytes = None) -> None:
+        """Run ffmpeg with the given arguments, raising RuntimeError with its stderr on failure"""
+        cmd = [get_setting("FFMPEG_BINARY"), '-y', '-loglevel', 'error', *args]
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if input_data is not None else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
         try:
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=100,
-                temperature=0.7
-            )
-            hashtags_str = response.choices[0].message.content.strip()
-            # Parse hashtags (assuming they are comma-separated or space-separated)
-            return [h.strip() for h in hashtags_str.replace('#', '').split() if h.strip()]
-        except Exception as e:
-            logging.error(f"Error generating hashtags: {e}")
-            return ["#TikTokViral", "#ForYou", "#AIContent"] # Fallback
+            _, stderr = await process.communicate(input_data)
+        except asyncio.CancelledError:
+            # Don't leave ffmpeg writing into a directory that is about to be removed
+            process.kill()
+            await process.wait()
+            raise
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to {description}: {stderr.decode(errors='replace')[-2000:]}")
 
-    async def _generate_title(self, script: str, language: str) -> str:
-        """Generate a catchy title for the TikTok video."""
-        prompt = f"""
-        Generate a catchy and engaging title for a TikTok video based on the following script, for {language} audience. The title should be short and attention-grabbing.
-        
-        Script: {script}
-        
-        Requirements:
-        1. Title should be under 25 characters.
-        2. Make it intriguing.
-        """
-        try:
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=50,
-                temperature=0.7
-            )
-            title = response.choices[0].message.content.strip()
-            return title[:25] # Truncate to 25 characters
-        except Exception as e:
-            logging.error(f"Error generating title: {e}")
-            return "Watch This Now!" # Fallback
+    async def _get_video_duration(self, video_path: str) -> float:
+        """Get video duration in seconds."""
+        process = await asyncio.create_subprocess_exec(
+            FFPROBE_BINARY, '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', video_path,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"ffprobe failed on {video_path}: {stderr.decode(errors='replace')}")
+        return float(json.loads(stdout)['format']['duration'])
 
 # Example usage (for testing this module independently)
 if __name__ == "__main__":
-    import shutil
-    import os
     from dotenv import load_dotenv
 
     load_dotenv() # Load environment variables from .env
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from contextlib import asynccontextmanager
 
@@ -12,8 +13,11 @@ from app.core.celery_app import celery_app
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all) # Create all tables if they don't exist
+    # Deployments that manage the schema with Alembic can set AUTO_CREATE_TABLES=false, which saves
+    # every worker a round of CREATE TABLE IF NOT EXISTS checks before it can serve
+    if getattr(settings, 'AUTO_CREATE_TABLES', True):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all) # Create all tables if they don't exist
     yield
     # Shutdown
     pass
@@ -40,6 +44,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON responses; tiny payloads are not worth the CPU
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
 # Include Routers
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(social_accounts.router, prefix="/api/accounts", tags=["Social Accounts"])